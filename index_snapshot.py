@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+index_snapshot.py
+
+– Compact binary copy of an index for Python-side lookups and crawl resume
+– Terms are kept in a marisa-trie: shared prefixes are stored once,
+  and lookups / prefix searches need no term dict in memory
+– Postings are uint32 records addressed by trie key id
+– Read through mmap: opening a snapshot parses nothing but the URL tables,
+  postings are decoded only for the terms you ask for
+– Written to a temp file and renamed into place, so an interrupted save
+  leaves the previous snapshot intact
+– Usage: python index_snapshot.py search_index.snapshot <term-prefix>
+
+Layout (native byte order):
+  header   magic, version, flags, url count, queue count, term count, trie size
+  strings  start url, urls[url count], queue[queue count]  (uint32 length + utf-8)
+  trie     marisa-trie bytes, zero-padded to 8 bytes
+  offsets  uint64[term count + 1], start of each term's postings in `words`
+  words    uint32 records per page: url id, n, n positions  (POSITIONS flag)
+                                    url id, count           (otherwise)
+"""
+
+import os
+import sys
+import mmap
+import struct
+import marisa_trie
+from array import array
+
+MAGIC     = b'WSIX'
+VERSION   = 1
+HEADER    = struct.Struct('=4sHHIIIQ')
+LENGTH    = struct.Struct('=I')
+POSITIONS = 0x1   # flag: postings hold positions rather than a count
+
+# ——— WRITE ———
+def _write_strings(f, strings):
+    for s in strings:
+        b = s.encode()
+        f.write(LENGTH.pack(len(b)))
+        f.write(b)
+
+def save(path, start_url, urls, queue, index, positions=True):
+    trie    = marisa_trie.Trie(index)
+    offsets = array('Q', [0])
+    words   = array('I')
+    for tid in range(len(trie)):
+        for uid, posting in index[trie.restore_key(tid)].items():
+            if positions:
+                words.extend((int(uid), len(posting)))
+                words.extend(posting)
+            else:
+                words.extend((int(uid), posting))
+        offsets.append(len(words))
+
+    blob = trie.tobytes()
+    tmp  = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, POSITIONS if positions else 0,
+                            len(urls), len(queue), len(trie), len(blob)))
+        _write_strings(f, [start_url])
+        _write_strings(f, urls)
+        _write_strings(f, queue)
+        f.write(blob)
+        f.write(b'\0' * (-f.tell() % 8))
+        offsets.tofile(f)
+        words.tofile(f)
+    os.replace(tmp, path)
+
+# ——— READ ———
+def _read_strings(buf, pos, count):
+    strings = []
+    for _ in range(count):
+        n, = LENGTH.unpack_from(buf, pos)
+        pos += LENGTH.size
+        strings.append(str(buf[pos:pos + n], 'utf-8'))
+        pos += n
+    return strings, pos
+
+class Snapshot:
+    """Read-only, mmap-backed view of a saved index."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except Exception as e:
+            # truncated or corrupt: no views are held yet, so the map can close
+            self._mm.close()
+            raise ValueError(f"{path} is not a valid version {VERSION} index snapshot") from e
+
+    def _open(self):
+        mm = self._mm
+        magic, version, flags, n_urls, n_queue, n_terms, trie_size = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("bad magic or version")
+
+        self.positions = bool(flags & POSITIONS)
+        (self.start_url,), pos = _read_strings(mm, HEADER.size, 1)
+        self.urls,  pos = _read_strings(mm, pos, n_urls)
+        self.queue, pos = _read_strings(mm, pos, n_queue)
+        if pos + trie_size > len(mm):
+            raise ValueError("truncated trie")
+        self.trie = marisa_trie.Trie().frombytes(mm[pos:pos + trie_size])
+        pos += trie_size
+        pos += -pos % 8
+
+        # the last offset says how many words follow: the file must end there
+        end = pos + 8 * (n_terms + 1)
+        n_words, = struct.unpack_from('=Q', mm, end - 8)
+        if end + 4 * n_words != len(mm):
+            raise ValueError("truncated postings")
+
+        with memoryview(mm) as view:
+            self._offsets = view[pos:end].cast('Q')
+            self._words   = view[end:].cast('I')
+
+    def _decode(self, tid):
+        words = self._words[self._offsets[tid]:self._offsets[tid + 1]]
+        postings, i = {}, 0
+        while i < len(words):
+            if self.positions:
+                n = words[i + 1]
+                postings[words[i]] = words[i + 2:i + 2 + n].tolist()
+                i += 2 + n
+            else:
+                postings[words[i]] = words[i + 1]
+                i += 2
+        return postings
+
+    def postings(self, term):
+        # {url id → positions | count}, empty if the term isn't indexed
+        tid = self.trie.get(term)
+        return {} if tid is None else self._decode(tid)
+
+    def items(self, prefix=''):
+        for term, tid in self.trie.items(prefix):
+            yield term, self._decode(tid)
+
+    def close(self):
+        self._offsets.release()
+        self._words.release()
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: python index_snapshot.py <snapshot> <term-prefix>")
+        sys.exit(1)
+
+    with Snapshot(sys.argv[1]) as snap:
+        for term, postings in snap.items(sys.argv[2].lower()):
+            print(f"{term}: {len(postings)} pages")
@@ -2,22 +2,75 @@
 """
 indexer_live_single_fixed.py
 
-– Single-threaded crawl + index
-– Flush index to JSON every FLUSH_EVERY pages
+– Concurrent crawl (asyncio + aiohttp) + index
+– Pages parsed + tokenized in a process pool, one worker per core
+– Append new postings to an NDJSON delta log (zstd if available) every FLUSH_EVERY pages
+– Merge the log into the JSON index once, at the end, plus a trie-keyed
+  binary snapshot (index_snapshot.py) for Python-side lookups
+– Ctrl-C still writes the index; rerunning the same command resumes the
+  crawl from the snapshot instead of starting over
 – Only visible text under <body>
 – Correct link resolution: use current page URL as base
-– Skip non-HTML URLs
+– Skip non-HTML URLs and paths disallowed by robots.txt
+– Canonicalize links and dedupe them before they are queued
 – Safe parsing with error catches
 – Usage: python indexer_live_single_fixed.py https://your-site.com
 """
 
+import io
+import os
+import codecs
 import sys
 import json
 import re
-import requests
-from html.parser import HTMLParser
-from urllib.parse import urljoin, urlparse
+import hashlib
+import signal
+import asyncio
+import aiohttp
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from selectolax.lexbor import LexborHTMLParser
+from urllib.parse import urljoin, urlparse, urlunparse
+from urllib.robotparser import RobotFileParser
 from os.path import splitext
+import index_snapshot
+
+try:
+    import orjson   # optional: much faster JSON encode/decode
+except ImportError:
+    orjson = None
+try:
+    import zstandard   # optional: zstd-compress the delta log
+except ImportError:
+    zstandard = None
+try:
+    import pyximport   # optional: compile tok_index.pyx (needs Cython + a C compiler)
+    pyximport.install(language_level=3)
+    import tok_index
+except ImportError:
+    tok_index = None
+
+# ——— URLS ———
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+# One spelling per page: lowercase host, no default port or fragment,
+# sorted query, and "dir/index.html" folded into "dir/"
+def canonicalize(url):
+    p = urlparse(url)
+    netloc = p.netloc.lower()
+    port = DEFAULT_PORTS.get(p.scheme)
+    if port and netloc.endswith(port):
+        netloc = netloc[:-len(port)]
+    path = p.path or '/'
+    if path.endswith('/index.html'):
+        path = path[:-len('index.html')]
+    # sort the raw parameters by name, without decoding them; the sort is
+    # stable, so repeated keys keep their order
+    query = '&'.join(sorted(p.query.split('&'), key=lambda kv: kv.split('=', 1)[0]))
+    return urlunparse((p.scheme, netloc, path, p.params, query, ''))
 
 # ——— CONFIG ———
 if len(sys.argv) < 2:
@@ -25,9 +78,17 @@ if len(sys.argv) < 2:
     sys.exit(1)
 
 START_URL   = sys.argv[1]
-DOMAIN      = urlparse(START_URL).netloc
+DOMAIN      = urlparse(canonicalize(START_URL)).netloc   # as canonical links spell it
 OUTPUT_JSON = 'search_index.json'
-FLUSH_EVERY = 50   # write the JSON every 50 pages
+SNAPSHOT    = 'search_index.snapshot'
+DELTA_LOG   = 'search_index.delta.ndjson' + ('.zst' if zstandard else '')
+FLUSH_EVERY = 50   # append to the delta log every 50 pages
+CONCURRENCY = 20   # max downloads in flight at once
+WORKERS     = os.cpu_count() or 1   # processes parsing pages
+MAX_BYTES   = 5_000_000   # skip pages larger than this
+# False: store a term count per page instead of positions (smaller and
+# faster, but search_server_multi_exact.js can no longer match phrases)
+POSITION_INDEX = True
 
 # Allowed URL patterns: directories, .html/.htm, or no extension
 def is_likely_html(url):
@@ -40,123 +101,350 @@ def is_likely_html(url):
         return True
     return False
 
-# ——— PARSERS ———
-class TextExtractor(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.in_body = False
-        self.skip    = False
-        self.chunks  = []
-
-    def handle_starttag(self, tag, attrs):
-        tag = tag.lower()
-        if tag == 'body':
-            self.in_body = True
-        elif self.in_body and tag in ('script', 'style', 'head'):
-            self.skip = True
-
-    def handle_endtag(self, tag):
-        tag = tag.lower()
-        if tag == 'body':
-            self.in_body = False
-        elif tag in ('script', 'style', 'head'):
-            self.skip = False
-
-    def handle_data(self, data):
-        if self.in_body and not self.skip:
-            self.chunks.append(data)
-
-    def text(self):
-        return ' '.join(self.chunks)
-
-class LinkExtractor(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.links = []
-
-    def handle_starttag(self, tag, attrs):
-        if tag.lower() == 'a':
-            for (k, v) in attrs:
-                if k.lower() == 'href' and v:
-                    self.links.append(v)
+# ——— PARSER ———
+SKIP_TAGS = ['script', 'style']   # dropped before reading <body> text
+
+def extract(html):
+    """Parse the page once; return (visible <body> text, <a href> links)."""
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(SKIP_TAGS)
+    body = tree.body
+    text = body.text(separator=' ') if body else ''
+    hrefs = (a.attributes.get('href') for a in tree.css('a[href]'))
+    # nav bars repeat links: dedupe here so each one is resolved and checked once
+    return text, list(dict.fromkeys(h for h in hrefs if h))
 
 # ——— HELPERS ———
+TOKEN_RE = re.compile(r'\w+')
+
 def tokenize(text):
-    return [tok.lower() for tok in re.split(r'\W+', text) if tok]
+    # lowering the whole text first is faster, but only safe for ASCII: some
+    # mappings add characters \w doesn't match ('İ' → 'i' + U+0307)
+    if text.isascii():
+        return TOKEN_RE.findall(text.lower())
+    return [t.lower() for t in TOKEN_RE.findall(text)]
 
-def flush_index(idx):
-    with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-        json.dump(idx, f)
-    print(f"→ Flushed index ({len(idx)} terms) to {OUTPUT_JSON}")
+def group_positions(tokens):
+    # one pass over the page: term → [positions]
+    page  = {}
+    group = page.setdefault
+    for pos, term in enumerate(tokens):
+        group(term, []).append(pos)
+    return page
 
-# ——— CRAWL & INDEX ———
-def main():
-    to_crawl   = [START_URL]
-    seen       = set()
-    index      = {}
-    page_count = 0
+def page_positions(text):
+    # term → [positions] for one page
+    return group_positions(tokenize(text))
+
+if tok_index:   # same loop, compiled
+    page_positions = tok_index.page_positions
+
+def parse_page(html):
+    # runs in a worker process: html → ({term → positions | count}, links)
+    text, links = extract(html)
+    if POSITION_INDEX:
+        return page_positions(text), links
+    return Counter(tokenize(text)), links
+
+def url_key(url):
+    # `seen` holds 8-byte digests instead of full URL strings
+    return hashlib.blake2b(url.encode(), digest_size=8).digest()
 
-    while to_crawl:
-        url = to_crawl.pop(0)
-        if url in seen:
-            continue
-        seen.add(url)
+def dumps(obj):
+    # compact JSON bytes; url-id keys are ints and positions are arrays
+    if orjson:
+        return orjson.dumps(obj, default=list, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':'), default=list).encode()
 
-        # Skip obviously non-HTML URLs
-        if not is_likely_html(url):
-            print(f"→ Skipping non-HTML URL: {url}")
-            continue
+loads = orjson.loads if orjson else json.loads
 
+# a kill mid-write can leave a torn last line
+LOG_ERRORS = (ValueError, zstandard.ZstdError) if zstandard else ValueError
+
+def _append_log(obj):
+    data = dumps(obj) + b'\n'
+    if zstandard:
+        data = zstandard.ZstdCompressor(level=3).compress(data)   # one frame per line
+    with open(DELTA_LOG, 'ab') as f:
+        f.write(data)
+
+def start_log(start, base):
+    # header line: the crawl the flushes extend, so replay_log() can finish
+    # it if the process dies without unwinding
+    open(DELTA_LOG, 'wb').close()
+    _append_log({'start': start, 'base': base, 'positions': POSITION_INDEX})
+
+def append_delta(urls, idx, queued):
+    # one line per flush: pages indexed (keyed by url id) and links queued
+    # since the last flush
+    _append_log({'urls': urls, 'index': idx, 'queued': queued})
+    print(f"→ Appended {len(urls)} pages ({len(idx)} terms) to {DELTA_LOG}")
+
+def read_log():
+    # the header, then one dict per flush, up to any torn last line
+    with open(DELTA_LOG, 'rb') as f:
+        lines = f
+        if zstandard:
+            dctx  = zstandard.ZstdDecompressor()
+            lines = io.BufferedReader(dctx.stream_reader(f, read_across_frames=True))
         try:
-            r = requests.get(url, timeout=10)
-            r.raise_for_status()
-        except Exception as e:
-            print(f"✗ Failed to fetch: {url}  ({e})")
-            continue
+            for line in lines:
+                yield loads(line)
+        except LOG_ERRORS:
+            print(f"⚠️  Ignoring a torn last line in {DELTA_LOG}")
 
-        # Skip if content-type isn’t HTML
-        content_type = r.headers.get('Content-Type', '')
-        if 'text/html' not in content_type:
-            print(f"→ Skipping non-HTML content: {url} [{content_type}]")
-            continue
+def load_resume(start):
+    # an interrupted crawl of the same start URL leaves its queue in the snapshot
+    try:
+        snap = index_snapshot.Snapshot(SNAPSHOT)
+    except (OSError, ValueError):
+        return None
+    if snap.queue and snap.start_url == start and snap.positions == POSITION_INDEX:
+        return snap
+    snap.close()
+    return None
 
-        html = r.text
+def write_index(start, queue, resumed=None, positions=POSITION_INDEX):
+    # merge the resumed snapshot and the delta log into the final index, write
+    # the JSON and a new snapshot (with any unfinished queue) once, drop the log
+    urls, idx = [], {}
+    if resumed:
+        urls.extend(resumed.urls)
+        idx.update(resumed.items())
+        resumed.close()
+    log = read_log()
+    next(log, None)   # header
+    for delta in log:
+        urls.extend(delta['urls'])
+        for term, postings in delta['index'].items():
+            idx.setdefault(term, {}).update(postings)
+    with open(OUTPUT_JSON + '.tmp', 'wb') as f:
+        f.write(dumps({'urls': urls, 'index': idx}))
+    os.replace(OUTPUT_JSON + '.tmp', OUTPUT_JSON)
+    index_snapshot.save(SNAPSHOT, start, urls, queue, idx, positions)
+    os.remove(DELTA_LOG)
+    print(f"→ Wrote index ({len(idx)} terms) to {OUTPUT_JSON} and {SNAPSHOT}")
 
-        # Everything from here on is “best-effort” parsing
+def replay_log():
+    # A crawl killed without unwinding (SIGTERM, OOM, crash) leaves its log
+    # behind. Fold it into the JSON and snapshot, queueing every link it had
+    # queued but not indexed, so this run resumes the crawl instead of
+    # truncating the only copy of its pages.
+    log    = read_log()
+    header = next(log, None)
+    if header is None:   # died before its first line
+        os.remove(DELTA_LOG)
+        return
+    start, base = header['start'], header['base']
+    print(f"↻ Replaying {DELTA_LOG} from an unfinished crawl of {start}")
+    resumed = None
+    if base:
+        # that crawl resumed from the snapshot, which only write_index() replaces
         try:
-            # 1) Extract visible text
-            te = TextExtractor()
-            te.feed(html)
-            tokens = tokenize(te.text())
-
-            # 2) Update inverted index
-            for pos, term in enumerate(tokens):
-                postings = index.setdefault(term, {})
-                postings.setdefault(url, []).append(pos)
-
-            # 3) Enqueue same-domain HTML links
-            le = LinkExtractor()
-            le.feed(html)
-            for href in le.links:
-                candidate = href.split('#')[0]
-                abs_link  = urljoin(url, candidate)
-                if (urlparse(abs_link).netloc == DOMAIN
-                    and abs_link not in seen
-                    and is_likely_html(abs_link)):
-                    to_crawl.append(abs_link)
-
-            page_count += 1
-            if page_count % FLUSH_EVERY == 0:
-                print(f"Indexed {page_count} pages (queue: {len(to_crawl)})")
-                flush_index(index)
-
-        except Exception as e:
-            print(f"⚠️  Error parsing/indexing {url}: {e}")
-            continue
-
-    # final flush
-    print(f"\nDone! Total pages indexed: {page_count}")
-    flush_index(index)
+            resumed = index_snapshot.Snapshot(SNAPSHOT)
+        except (OSError, ValueError):
+            pass
+        if not resumed or resumed.start_url != start or len(resumed.urls) != base:
+            sys.exit(f"✗ {DELTA_LOG} continues a snapshot that is gone; "
+                     "move it away to start over")
+    queued  = list(resumed.queue) if resumed else [start]
+    indexed = set()
+    for delta in log:
+        queued.extend(delta['queued'])
+        indexed.update(delta['urls'])
+    write_index(start, [u for u in dict.fromkeys(queued) if u not in indexed],
+                resumed, header['positions'])
+
+# ——— FETCH ———
+async def fetch(session, url):
+    """Download one page; returns its HTML, or None if it failed or isn't HTML."""
+    try:
+        async with session.get(url) as r:
+            r.raise_for_status()
+
+            # Skip if content-type isn’t HTML
+            content_type = r.headers.get('Content-Type', '')
+            if 'text/html' not in content_type:
+                print(f"→ Skipping non-HTML content: {url} [{content_type}]")
+                return None
+
+            # Skip pages that announce themselves as too large, and stop
+            # reading any that turn out to be
+            if (r.content_length or 0) > MAX_BYTES:
+                print(f"→ Skipping oversized page: {url} [{r.content_length} bytes]")
+                return None
+            body = bytearray()
+            async for chunk in r.content.iter_chunked(65536):
+                body += chunk
+                if len(body) > MAX_BYTES:
+                    print(f"→ Skipping oversized page: {url} [> {MAX_BYTES} bytes]")
+                    return None
+
+            # Skip binaries served as text/html (no markup near the start)
+            if b'<' not in body[:1024]:
+                print(f"→ Skipping non-HTML content: {url} [no markup]")
+                return None
+
+            # an unknown charset label (e.g. utf8mb4) falls back to utf-8, as r.text() does
+            charset = r.charset or 'utf-8'
+            try:
+                codecs.lookup(charset)
+            except (LookupError, ValueError):
+                charset = 'utf-8'
+            return body.decode(charset, errors='replace')
+    except Exception as e:
+        print(f"✗ Failed to fetch: {url}  ({e})")
+        return None
+
+async def crawl_page(session, pool, url):
+    """Fetch a page and parse it in the worker pool; None if either step fails."""
+    html = await fetch(session, url)
+    if html is None:
+        return None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, parse_page, html)
+    except BrokenProcessPool:
+        raise   # not this page's fault: every later parse would fail too
+    except Exception as e:
+        print(f"⚠️  Error parsing/indexing {url}: {e}")
+        return None
+
+async def load_robots(session, start_url):
+    """Fetch the site's robots.txt; a missing file allows everything."""
+    robots = RobotFileParser()
+    robots_url = urljoin(start_url, '/robots.txt')
+    try:
+        async with session.get(robots_url) as r:
+            if r.status in (401, 403):
+                robots.disallow_all = True
+            elif r.status >= 400:
+                robots.allow_all = True
+            else:
+                robots.parse((await r.text(errors='replace')).splitlines())
+    except Exception as e:
+        print(f"✗ Failed to fetch: {robots_url}  ({e})")
+        robots.allow_all = True
+    return robots
+
+# ——— CRAWL & INDEX ———
+async def main():
+    start      = canonicalize(START_URL)
+    to_crawl   = deque([start])
+    seen       = {url_key(start)}   # url_key() digests, marked when queued
+    url_count  = 0       # next url id
+    new_urls   = []      # urls indexed since the last flush
+    new_queued = []      # links queued since the last flush
+    delta      = {}      # term → {url id → positions | count} since the last flush
+    page_count = 0
+    pending    = {}      # in-flight fetch + parse task → url
+
+    if os.path.exists(DELTA_LOG):
+        replay_log()
+    resumed = load_resume(start)
+    if resumed:
+        # resumed pages keep their url ids and aren't fetched again
+        to_crawl  = deque(resumed.queue)
+        seen.update(url_key(u) for u in resumed.urls)
+        seen.update(url_key(u) for u in resumed.queue)
+        url_count = len(resumed.urls)
+        print(f"↻ Resuming: {url_count} pages already indexed, {len(to_crawl)} queued")
+
+    # Per-link lookups bound once: locals are cheaper than globals and attributes
+    _canonicalize, _urljoin, _urlparse, _url_key = canonicalize, urljoin, urlparse, url_key
+    _is_html      = is_likely_html
+    seen_add      = seen.add
+    queue_append  = to_crawl.append
+
+    start_log(start, url_count)   # start a fresh log
+
+    # One keep-alive pool for the whole crawl. Every request goes to DOMAIN, so
+    # let the host use the full pool, and keep idle connections and DNS around.
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY, limit_per_host=CONCURRENCY,
+                                     keepalive_timeout=30, ttl_dns_cache=300)
+    timeout   = aiohttp.ClientTimeout(total=10)
+    # spawn: forking a process that already runs threads (aiohttp's resolver)
+    # isn't safe; workers ignore Ctrl-C and let the crawl loop shut down
+    pool = ProcessPoolExecutor(WORKERS, mp_context=get_context('spawn'),
+                               initializer=signal.signal,
+                               initargs=(signal.SIGINT, signal.SIG_IGN))
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            robots = await load_robots(session, start)
+
+            while to_crawl or pending:
+                # Top up the in-flight downloads from the queue
+                while to_crawl and len(pending) < CONCURRENCY:
+                    url = to_crawl.popleft()
+                    pending[asyncio.create_task(crawl_page(session, pool, url))] = url
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url    = pending.pop(task)
+                    try:
+                        parsed = task.result()
+                    except BrokenProcessPool:
+                        # a worker died (OOM kill, parser crash): stop, keeping
+                        # this URL queued in the snapshot for the rerun
+                        to_crawl.appendleft(url)
+                        raise
+                    if parsed is None:
+                        continue
+                    postings, links = parsed
+
+                    # Everything from here on is “best-effort” indexing
+                    try:
+                        # 1) Update inverted index
+                        uid = url_count
+                        url_count += 1
+                        new_urls.append(url)
+                        setdefault = delta.setdefault   # per page: delta is replaced on flush
+                        if POSITION_INDEX:
+                            for term, positions in postings.items():
+                                setdefault(term, {})[uid] = array('I', positions)
+                        else:
+                            for term, count in postings.items():
+                                setdefault(term, {})[uid] = count
+
+                        # 2) Enqueue same-domain HTML links
+                        for href in links:
+                            abs_link = _canonicalize(_urljoin(url, href))
+                            key = _url_key(abs_link)
+                            if key in seen:
+                                continue
+                            seen_add(key)
+                            if (_urlparse(abs_link).netloc == DOMAIN
+                                and _is_html(abs_link)
+                                and robots.can_fetch('*', abs_link)):
+                                queue_append(abs_link)
+                                new_queued.append(abs_link)
+
+                        page_count += 1
+                        if page_count % FLUSH_EVERY == 0:
+                            print(f"Indexed {page_count} pages (queue: {len(to_crawl)})")
+                            append_delta(new_urls, delta, new_queued)
+                            new_urls, delta, new_queued = [], {}, []
+
+                    except Exception as e:
+                        print(f"⚠️  Error indexing {url}: {e}")
+                        continue
+
+        print(f"\nDone! Total pages indexed: {page_count}")
+    finally:
+        pool.shutdown()
+        # final flush; on Ctrl-C the unfinished queue goes into the snapshot
+        append_delta(new_urls, delta, new_queued)
+        queue = list(pending.values()) + list(to_crawl)
+        write_index(start, queue, resumed)
+        if queue:
+            print(f"→ {len(queue)} URLs left to crawl; rerun the same command to resume")
 
 if __name__ == '__main__':
-    main()
+    # stop on `kill` / `timeout` / `systemctl stop` the way Ctrl-C does, so the
+    # pool is shut down and the index written (spawned workers keep the default)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Interrupted.")
+    except BrokenProcessPool:
+        sys.exit("✗ A parse worker died; rerun the same command to resume")
@@ -20,9 +20,23 @@ const JSON_PATH = './search_index.json';
 const SITE_URL  = process.env.SITE_URL || 'https://your-site.com';
 
 // —— LOAD INDEX ——
+/** Expand the indexer's { urls, index } layout into term → { url → positions | count } */
+function expandIndex(data) {
+  if (!Array.isArray(data.urls)) return data;  // already term → { url → positions }
+  const expanded = Object.create(null);  // no prototype: "__proto__" is a valid term
+  for (const [term, postings] of Object.entries(data.index)) {
+    const byUrl = Object.create(null);
+    for (const [id, positions] of Object.entries(postings)) {
+      byUrl[data.urls[id]] = positions;
+    }
+    expanded[term] = byUrl;
+  }
+  return expanded;
+}
+
 let indexData;
 try {
-  indexData = JSON.parse(fs.readFileSync(JSON_PATH, 'utf8'));
+  indexData = expandIndex(JSON.parse(fs.readFileSync(JSON_PATH, 'utf8')));
   console.log(`✅ Loaded index with ${Object.keys(indexData).length} terms`);
 } catch (err) {
   console.error(`❌ Failed to load ${JSON_PATH}:`, err);
@@ -22,6 +22,20 @@ const SITE_URL  = process.env.SITE_URL || 'https://your-site.com';
 const PORT      = process.env.PORT     || 3000;
 
 // —— LOAD MULTIPLE INDEXES ——
+// Expand the indexer's { urls, index } layout into term → { url → positions | count }
+function expandIndex(data) {
+  if (!Array.isArray(data.urls)) return data;  // already term → { url → positions }
+  const expanded = Object.create(null);  // no prototype: "__proto__" is a valid term
+  for (const [term, postings] of Object.entries(data.index)) {
+    const byUrl = Object.create(null);
+    for (const [id, positions] of Object.entries(postings)) {
+      byUrl[data.urls[id]] = positions;
+    }
+    expanded[term] = byUrl;
+  }
+  return expanded;
+}
+
 async function loadIndexes() {
   try {
     const files = await fs.promises.readdir(INDEX_DIR);
@@ -29,9 +43,9 @@ async function loadIndexes() {
     const indexes = await Promise.all(
       jsonFiles.map(async file => ({
         name: file,
-        data: JSON.parse(
+        data: expandIndex(JSON.parse(
           await fs.promises.readFile(path.join(INDEX_DIR, file), 'utf8')
-        )
+        ))
       }))
     );
     indexes.forEach(idx => {
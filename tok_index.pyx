@@ -0,0 +1,30 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+tok_index.pyx
+
+– Compiled version of the indexers' per-page tokenize + group loop
+– Loaded through pyximport when Cython is installed; the indexers fall back
+  to their pure-Python tokenize() / group_positions() otherwise
+"""
+
+import re
+
+cdef object TOKEN_RE = re.compile(r'\w+')
+
+def page_positions(str text):
+    # term → [positions] for one page, same as group_positions(tokenize(text))
+    cdef list tokens
+    if text.isascii():
+        tokens = TOKEN_RE.findall(text.lower())
+    else:
+        tokens = [t.lower() for t in TOKEN_RE.findall(text)]
+    cdef dict page = {}
+    cdef list positions
+    cdef Py_ssize_t i, n = len(tokens)
+    for i in range(n):
+        positions = <list>page.get(tokens[i])
+        if positions is None:
+            page[tokens[i]] = [i]
+        else:
+            positions.append(i)
+    return page